@@ -3,6 +3,6 @@
 This module defines a custom graph.
 """
 
-from agent.graph import graph
+from agent.graph import graph, run_many
 
-__all__ = ["graph"]
+__all__ = ["graph", "run_many"]
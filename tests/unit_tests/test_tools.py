@@ -0,0 +1,711 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import weakref
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator
+
+import anthropic
+import httpx
+import pytest
+from anthropic.types import Message, TextBlock, Usage
+from langchain.agents import create_agent
+from langchain.agents.middleware import ModelRequest, ModelResponse
+from langchain.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.fake_chat_models import (
+    FakeListChatModel,
+    FakeMessagesListChatModel,
+)
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode
+
+from agent.graph import execute_shell
+
+pytestmark = pytest.mark.anyio
+
+agent_graph = sys.modules["agent.graph"]
+
+
+async def test_tool_calls_run_concurrently(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Both calls must be in flight at once for the second one to release the first.
+    started = 0
+    both_started = asyncio.Event()
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        nonlocal started
+        started += 1
+        if started == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), timeout=5)
+        return command
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("tools", ToolNode([execute_shell]))
+    builder.add_edge(START, "tools")
+    tools_graph = builder.compile()
+
+    message = AIMessage(
+        content="",
+        tool_calls=[
+            {"name": "execute_shell", "args": {"command": "echo a"}, "id": "1"},
+            {"name": "execute_shell", "args": {"command": "echo b"}, "id": "2"},
+        ],
+    )
+    result = await tools_graph.ainvoke({"messages": [message]})
+
+    tool_messages = result["messages"][1:]
+    assert [m.tool_call_id for m in tool_messages] == ["1", "2"]
+    assert [m.content for m in tool_messages] == ["echo a", "echo b"]
+
+
+async def test_container_checked_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[str] = []
+
+    async def fake_run_subprocess(
+        cmd: list[str], timeout: float
+    ) -> tuple[int, str, str]:
+        calls.append(cmd[1])
+        await asyncio.sleep(0)
+        return 0, "", ""
+
+    async def fake_exec_in_session(
+        command: str, timeout: float, head_bytes: int | None, tail_bytes: int
+    ) -> tuple[int, str]:
+        calls.append("exec")
+        return 0, "ok"
+
+    monkeypatch.setattr(agent_graph, "_run_subprocess", fake_run_subprocess)
+    monkeypatch.setattr(agent_graph, "_exec_in_session", fake_exec_in_session)
+    monkeypatch.setattr(agent_graph, "_container_checked_at", 0.0)
+
+    outputs = await asyncio.gather(
+        *(agent_graph.run_in_container(f"echo {i}") for i in range(3))
+    )
+
+    assert outputs == ["ok", "ok", "ok"]
+    assert calls.count("inspect") == 1
+    assert calls.count("exec") == 3
+
+
+def test_container_check_across_event_loops(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def fake_run_subprocess(
+        cmd: list[str], timeout: float
+    ) -> tuple[int, str, str]:
+        await asyncio.sleep(0)
+        return 0, "", ""
+
+    async def fake_exec_in_session(
+        command: str, timeout: float, head_bytes: int | None, tail_bytes: int
+    ) -> tuple[int, str]:
+        return 0, "ok"
+
+    monkeypatch.setattr(agent_graph, "_run_subprocess", fake_run_subprocess)
+    monkeypatch.setattr(agent_graph, "_exec_in_session", fake_exec_in_session)
+
+    async def run_concurrently() -> list[str]:
+        return await asyncio.gather(
+            *(agent_graph.run_in_container(f"echo {i}") for i in range(3))
+        )
+
+    for _ in range(2):
+        # Expire the TTL so each loop contends for the container lock
+        monkeypatch.setattr(agent_graph, "_container_checked_at", 0.0)
+        assert asyncio.run(run_concurrently()) == ["ok", "ok", "ok"]
+
+
+async def test_missing_container_is_recreated(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[str] = []
+
+    async def fake_run_subprocess(
+        cmd: list[str], timeout: float
+    ) -> tuple[int, str, str]:
+        calls.append(cmd[1])
+        return (1 if cmd[1] == "inspect" else 0), "", ""
+
+    async def fake_exec_in_session(
+        command: str, timeout: float, head_bytes: int | None, tail_bytes: int
+    ) -> tuple[int, str]:
+        calls.append("exec")
+        if calls.count("exec") == 1:
+            return 1, "Error: No such container: langgraph-test-runner"
+        return 0, "ok"
+
+    monkeypatch.setattr(agent_graph, "_run_subprocess", fake_run_subprocess)
+    monkeypatch.setattr(agent_graph, "_exec_in_session", fake_exec_in_session)
+    # Pretend the container was seen moments ago so the first exec skips inspect.
+    monkeypatch.setattr(agent_graph, "_container_checked_at", time.monotonic())
+
+    output = await agent_graph.run_in_container("echo hi")
+
+    assert output == "ok"
+    assert calls == ["exec", "inspect", "image", "run", "exec"]
+
+
+async def test_command_mentioning_missing_container_is_not_retried(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands: list[str] = []
+
+    async def fake_exec_in_session(
+        command: str, timeout: float, head_bytes: int | None, tail_bytes: int
+    ) -> tuple[int, str]:
+        commands.append(command)
+        return (
+            1,
+            "FAILED test_docker.py - Error: No such container: langgraph-test-runner",
+        )
+
+    monkeypatch.setattr(agent_graph, "_exec_in_session", fake_exec_in_session)
+    monkeypatch.setattr(agent_graph, "_container_checked_at", time.monotonic())
+
+    output = await agent_graph.run_in_container("pytest test_docker.py")
+
+    assert output.endswith("\nExit code: 1")
+    assert commands == ["pytest test_docker.py"]
+
+
+@pytest.mark.parametrize(
+    ("head_bytes", "tail_bytes", "expected"),
+    [
+        (None, 0, (b"0123456789" * 3, 0, b"")),
+        (5, 4, (b"01234", 21, b"6789")),
+        (50, 4, (b"0123456789" * 3, 0, b"")),
+        (0, 12, (b"", 18, b"890123456789")),
+    ],
+)
+async def test_read_head_tail(
+    head_bytes: int | None, tail_bytes: int, expected: tuple[bytes, int, bytes]
+) -> None:
+    async def chunks() -> AsyncIterator[bytes]:
+        for _ in range(3):
+            yield b"0123456789"
+
+    assert (
+        await agent_graph._read_head_tail(chunks(), head_bytes, tail_bytes) == expected
+    )
+
+
+async def test_bash_session_reused_between_commands(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    started = 0
+
+    async def start_local_bash() -> object:
+        nonlocal started
+        started += 1
+        proc = await asyncio.create_subprocess_exec(
+            "bash",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        return agent_graph._BashSession(proc)
+
+    idle_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    monkeypatch.setattr(agent_graph._BashSession, "start", start_local_bash)
+    monkeypatch.setattr(agent_graph, "_idle_sessions", idle_sessions)
+
+    try:
+        first = await agent_graph._exec_in_session("cd /; echo out; echo err >&2", 5)
+        # stdin is closed for each command, and `cd` doesn't leak into the next one
+        second = await agent_graph._exec_in_session("cat; pwd; exit 3", 5)
+        truncated = await agent_graph._exec_in_session("seq 1 10000", 5, 6, 6)
+    finally:
+        for session in idle_sessions.pop(asyncio.get_running_loop(), []):
+            await session.close()
+
+    assert first == (0, "out\nerr\n")
+    assert second[0] == 3 and second[1] != "/\n"
+    assert truncated[1].startswith("1\n2\n3\n")
+    assert truncated[1].endswith("10000\n")
+    assert started == 1
+
+
+def test_bash_sessions_kept_per_event_loop(monkeypatch: pytest.MonkeyPatch) -> None:
+    sessions: list = []
+
+    async def start_local_bash() -> object:
+        proc = await asyncio.create_subprocess_exec(
+            "bash",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        sessions.append(agent_graph._BashSession(proc))
+        return sessions[-1]
+
+    monkeypatch.setattr(agent_graph._BashSession, "start", start_local_bash)
+    monkeypatch.setattr(agent_graph, "_idle_sessions", weakref.WeakKeyDictionary())
+
+    def echo() -> Any:
+        return agent_graph._exec_in_session("echo ok", 5)
+
+    try:
+        # Sync tool calls and successive `asyncio.run`s interleave
+        assert agent_graph._run_sync(echo()) == (0, "ok\n")
+        assert asyncio.run(echo()) == (0, "ok\n")
+        assert asyncio.run(echo()) == (0, "ok\n")
+        assert agent_graph._run_sync(echo()) == (0, "ok\n")
+        # The sync loop's session is reused, each `asyncio.run` starts its own,
+        # and sessions of closed loops are killed instead of being left running
+        assert len(sessions) == 3
+        assert [session.alive for session in sessions] == [True, False, False]
+    finally:
+        for session in sessions:
+            session.kill()
+
+    for session in sessions[1:]:
+        with pytest.raises(ProcessLookupError):
+            for _ in range(100):
+                os.kill(session.proc.pid, 0)
+                time.sleep(0.01)
+
+
+async def test_response_cache_replays_model_response(tmp_path: Path) -> None:
+    middleware = agent_graph.ResponseCacheMiddleware(directory=str(tmp_path))
+    model = FakeListChatModel(responses=["first", "second"])
+    agent = create_agent(
+        model=model, system_prompt="You are a test runner.", middleware=[middleware]
+    )
+
+    first = await agent.ainvoke({"messages": [HumanMessage(content="run the tests")]})
+    second = await agent.ainvoke({"messages": [HumanMessage(content="run the tests")]})
+
+    # The second run is replayed from the cache without calling the model
+    assert model.i == 1
+    assert first["messages"][-1].content == "first"
+    assert second["messages"][-1].content == "first"
+
+    # A changed tool schema or model setting must not replay the cached response
+    calls = 0
+
+    async def handler(req: ModelRequest) -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        return ModelResponse(result=[AIMessage(content="done")])
+
+    request = ModelRequest(
+        model=model,
+        messages=[HumanMessage(content="run the tests")],
+        system_prompt="You are a test runner.",
+    )
+    await middleware.awrap_model_call(request.override(tools=[execute_shell]), handler)
+    await middleware.awrap_model_call(
+        request.override(model_settings={"temperature": 0}), handler
+    )
+    assert calls == 2
+
+
+async def test_run_many_limits_concurrency(monkeypatch: pytest.MonkeyPatch) -> None:
+    running = 0
+    peak = 0
+
+    class FakeGraph:
+        async def ainvoke(self, agent_input: dict) -> dict:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return {"echo": agent_input["n"]}
+
+    monkeypatch.setattr(agent_graph, "graph", FakeGraph())
+
+    results = await agent_graph.run_many(
+        [{"n": i} for i in range(5)], max_concurrency=2
+    )
+
+    assert results == [{"echo": i} for i in range(5)]
+    assert peak == 2
+
+
+async def test_auto_triggered_model_call_uses_batch_api() -> None:
+    submitted: list[dict] = []
+
+    class FakeBatches:
+        async def create(self, requests: list[dict]) -> SimpleNamespace:
+            submitted.extend(requests)
+            return SimpleNamespace(id="batch_1", processing_status="in_progress")
+
+        async def retrieve(self, batch_id: str) -> SimpleNamespace:
+            return SimpleNamespace(id=batch_id, processing_status="ended")
+
+        async def results(self, batch_id: str) -> AsyncIterator[SimpleNamespace]:
+            message = Message(
+                id="msg_1",
+                type="message",
+                role="assistant",
+                model="claude-sonnet-4-5-20250929",
+                content=[TextBlock(type="text", text="all tests passed")],
+                stop_reason="end_turn",
+                stop_sequence=None,
+                usage=Usage(input_tokens=10, output_tokens=5),
+            )
+
+            async def entries() -> AsyncIterator[SimpleNamespace]:
+                yield SimpleNamespace(
+                    result=SimpleNamespace(type="succeeded", message=message)
+                )
+
+            return entries()
+
+    model = ChatAnthropic(model="claude-sonnet-4-5-20250929", api_key="test")
+    model.__dict__["_async_client"] = SimpleNamespace(
+        messages=SimpleNamespace(batches=FakeBatches())
+    )
+    middleware = agent_graph.BatchAutoTriggerMiddleware(poll_interval=0)
+
+    async def handler(req: ModelRequest) -> ModelResponse:
+        return ModelResponse(result=[AIMessage(content="real-time")])
+
+    interactive = ModelRequest(
+        model=model,
+        messages=[HumanMessage(content="run the tests")],
+        tools=[execute_shell],
+        state={"messages": []},
+    )
+    response = await middleware.awrap_model_call(interactive, handler)
+    assert response.result[0].content == "real-time"
+    assert submitted == []
+
+    auto_triggered = ModelRequest(
+        model=model,
+        messages=[HumanMessage(content="run the tests")],
+        system_prompt="You are a test runner.",
+        tools=[execute_shell],
+        state={"messages": [], "auto_triggered": True},
+    )
+    response = await middleware.awrap_model_call(auto_triggered, handler)
+
+    assert response.result[0].content == "all tests passed"
+    params = submitted[0]["params"]
+    assert params["system"] == "You are a test runner."
+    assert [t["name"] for t in params["tools"]] == ["execute_shell"]
+
+
+async def test_batch_falls_back_to_real_time() -> None:
+    cancelled: list[str] = []
+
+    class FailingBatches:
+        async def create(self, requests: list[dict]) -> SimpleNamespace:
+            raise anthropic.APIConnectionError(
+                request=httpx.Request("POST", "https://api.anthropic.com")
+            )
+
+    class StuckBatches:
+        async def create(self, requests: list[dict]) -> SimpleNamespace:
+            return SimpleNamespace(id="batch_1", processing_status="in_progress")
+
+        async def retrieve(self, batch_id: str) -> SimpleNamespace:
+            return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+        async def cancel(self, batch_id: str) -> None:
+            cancelled.append(batch_id)
+
+    async def handler(req: ModelRequest) -> ModelResponse:
+        return ModelResponse(result=[AIMessage(content="real-time")])
+
+    for batches, max_wait in ((FailingBatches(), 60.0), (StuckBatches(), 0.05)):
+        model = ChatAnthropic(model="claude-sonnet-4-5-20250929", api_key="test")
+        model.__dict__["_async_client"] = SimpleNamespace(
+            messages=SimpleNamespace(batches=batches)
+        )
+        middleware = agent_graph.BatchAutoTriggerMiddleware(
+            poll_interval=0.01, max_wait=max_wait
+        )
+        request = ModelRequest(
+            model=model,
+            messages=[HumanMessage(content="run the tests")],
+            state={"messages": [], "auto_triggered": True},
+        )
+
+        response = await middleware.awrap_model_call(request, handler)
+
+        assert response.result[0].content == "real-time"
+    assert cancelled == ["batch_1"]
+
+
+def test_chat_anthropic_members_used_by_batch_path() -> None:
+    # The batch path relies on private ChatAnthropic members (the tests above
+    # fake the client); fail loudly if an upgrade renames or reshapes them
+    model = ChatAnthropic(model="claude-sonnet-4-5-20250929", api_key="test")
+
+    assert isinstance(model._async_client, anthropic.AsyncAnthropic)
+    payload = model._get_request_payload([HumanMessage(content="hi")], stream=True)
+    assert payload["model"] == "claude-sonnet-4-5-20250929"
+    assert payload["messages"][0]["role"] == "user"
+
+    message = Message(
+        id="msg_1",
+        type="message",
+        role="assistant",
+        model="claude-sonnet-4-5-20250929",
+        content=[TextBlock(type="text", text="ok")],
+        stop_reason="end_turn",
+        stop_sequence=None,
+        usage=Usage(input_tokens=1, output_tokens=1),
+    )
+    output = model._format_output(message).generations[0].message
+    assert isinstance(output, AIMessage)
+    assert output.content == "ok"
+
+
+class StreamingToolCallModel(BaseChatModel):
+    """Streams `execute_shell` calls, then waits for the first tool before finishing."""
+
+    calls: list[dict[str, Any]] = [{"command": "echo a"}, {"command": "echo b"}]
+    first_tool_started: Any = None
+    fail_mid_stream: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "streaming-tool-call"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        return self.bind(**kwargs)
+
+    def _generate(self, *args: Any, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def _astream(
+        self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if any(m.type == "tool" for m in messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="done"))
+            return
+        for index, args in enumerate(self.calls, start=1):
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": "execute_shell",
+                            "args": json.dumps(args),
+                            "id": f"call_{index}",
+                            "index": index,
+                        }
+                    ],
+                )
+            )
+        if self.fail_mid_stream:
+            raise RuntimeError("stream dropped")
+        if self.first_tool_started is not None:
+            # The first call must already be running while the model is still decoding
+            await asyncio.wait_for(self.first_tool_started.wait(), timeout=5)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=""))
+
+
+async def test_speculative_tool_calls_overlap_decoding(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    first_tool_started = asyncio.Event()
+    commands: list[str] = []
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        commands.append(command)
+        if command == "echo a":
+            first_tool_started.set()
+        return command
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    agent = create_agent(
+        model=StreamingToolCallModel(first_tool_started=first_tool_started),
+        tools=[execute_shell],
+        middleware=[agent_graph.SpeculativeToolMiddleware()],
+    )
+    result = await agent.ainvoke({"messages": [HumanMessage(content="go")]})
+
+    tool_messages = [m for m in result["messages"] if m.type == "tool"]
+    assert [m.content for m in tool_messages] == ["echo a", "echo b"]
+    assert [m.tool_call_id for m in tool_messages] == ["call_1", "call_2"]
+    # Each tool ran exactly once, not again in the tool node
+    assert commands == ["echo a", "echo b"]
+    assert result["messages"][-1].content == "done"
+
+
+async def test_single_tool_call_runs_in_tool_node(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    pending_when_run: list[dict] = []
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        pending_when_run.append(dict(middleware._pending))
+        return command
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    middleware = agent_graph.SpeculativeToolMiddleware()
+    agent = create_agent(
+        model=StreamingToolCallModel(calls=[{"command": "echo a"}]),
+        tools=[execute_shell],
+        middleware=[middleware],
+    )
+    result = await agent.ainvoke({"messages": [HumanMessage(content="go")]})
+
+    tool_messages = [m for m in result["messages"] if m.type == "tool"]
+    assert [m.content for m in tool_messages] == ["echo a"]
+    # No later block marks the only call as complete, so it isn't started early
+    assert pending_when_run == [{}]
+    assert result["messages"][-1].content == "done"
+
+
+async def test_speculative_tool_call_with_invalid_args(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    commands: list[str] = []
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        commands.append(command)
+        return command
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    agent = create_agent(
+        model=StreamingToolCallModel(calls=[{"cmd": "ls"}, {"command": "echo b"}]),
+        tools=[execute_shell],
+        middleware=[agent_graph.SpeculativeToolMiddleware()],
+    )
+    result = await agent.ainvoke({"messages": [HumanMessage(content="go")]})
+
+    tool_messages = [m for m in result["messages"] if m.type == "tool"]
+    assert [m.status for m in tool_messages] == ["error", "success"]
+    assert tool_messages[1].content == "echo b"
+    # The invalid call is reported back to the model without running anything
+    assert commands == ["echo b"]
+
+
+async def test_speculative_tool_calls_cancelled_on_stream_error(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    first_tool_started = asyncio.Event()
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        first_tool_started.set()
+        await asyncio.Event().wait()
+        return command
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    middleware = agent_graph.SpeculativeToolMiddleware()
+    agent = create_agent(
+        model=StreamingToolCallModel(fail_mid_stream=True),
+        tools=[execute_shell],
+        middleware=[middleware],
+    )
+    with pytest.raises(RuntimeError, match="stream dropped"):
+        await agent.ainvoke({"messages": [HumanMessage(content="go")]})
+
+    assert first_tool_started.is_set()
+    assert middleware._pending == {}
+
+
+async def test_setup_downloads_test_deps_while_cloning(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    download_started = asyncio.Event()
+    commands: list[str] = []
+
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        commands.append(command)
+        if command.startswith("test -d"):
+            return "needs_setup"
+        if command.startswith("pip download"):
+            download_started.set()
+        if command.startswith("apt-get"):
+            await asyncio.wait_for(download_started.wait(), timeout=5)
+        return "ok"
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    await agent_graph.setup_repository.ainvoke({})
+
+    assert commands[-1].strip().startswith("cd /tmp/langgraph")
+    assert "--find-links /tmp/wheels" in commands[-1]
+    # Packages come from the requirements file shared with docker/Dockerfile
+    assert "-e libs/sdk-py" in commands[-1]
+    assert "'psycopg[binary]'" in commands[-1]
+
+
+def test_sync_invoke_runs_container_tools(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    commands: list[str] = []
+
+    async def fake_run_in_container(
+        command: str, timeout: int = 300, **kwargs: Any
+    ) -> str:
+        commands.append(command)
+        return (
+            "already_exists" if command.startswith("test -d") else "Already up to date."
+        )
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    assert "Already up to date." in agent_graph.setup_repository.invoke({})
+
+    class ToolCallingModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools: Any, **kwargs: Any) -> "ToolCallingModel":
+            return self
+
+    model = ToolCallingModel(
+        responses=[
+            AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": "execute_shell", "args": {"command": "ls"}, "id": "call_1"}
+                ],
+            ),
+            AIMessage(content="all green"),
+        ]
+    )
+    agent = create_agent(
+        model=model,
+        tools=[agent_graph.setup_repository, execute_shell],
+        middleware=[
+            agent_graph.AutoTriggerMiddleware(),
+            agent_graph.ResponseCacheMiddleware(directory=str(tmp_path)),
+            agent_graph.BatchAutoTriggerMiddleware(),
+            agent_graph.SpeculativeToolMiddleware(),
+        ],
+    )
+    result = agent.invoke({"messages": []})
+
+    assert result["messages"][-1].content == "all green"
+    assert [m.content for m in result["messages"] if m.type == "tool"] == [
+        "Already up to date."
+    ]
+    assert commands[-1] == "ls"
+
+
+@pytest.mark.parametrize(
+    ("pull_output", "expected"),
+    [
+        ("Already up to date.", "pulled latest changes"),
+        (
+            "fatal: Not possible to fast-forward, aborting.\nExit code: 128",
+            "git pull failed",
+        ),
+        ("Error: Command timed out after 120 seconds", "git pull failed"),
+    ],
+)
+async def test_setup_reports_pull_result(
+    monkeypatch: pytest.MonkeyPatch, pull_output: str, expected: str
+) -> None:
+    async def fake_run_in_container(command: str, timeout: int = 300) -> str:
+        return "already_exists" if command.startswith("test -d") else pull_output
+
+    monkeypatch.setattr(agent_graph, "run_in_container", fake_run_in_container)
+
+    output = await agent_graph.setup_repository.ainvoke({})
+
+    assert expected in output
+    assert output.endswith(pull_output)